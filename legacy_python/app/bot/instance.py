@@ -2,15 +2,17 @@ import logging
 import os
 import asyncio
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardRemove
+from telegram.error import RetryAfter, Forbidden, BadRequest
 from telegram.ext import (
     Application, CommandHandler, MessageHandler, ConversationHandler,
     ContextTypes, filters, CallbackQueryHandler
 )
+from datetime import datetime
 from app.config.settings import settings
-from app.ingestion.parser import run_parser
-from app.core.analyzer import run_analyzer
-from app.core.planner import run_planner
-from app.core.beautifier import run_beautifier
+from app.core.pipeline import run_day
+from app.jobs.queue import job_queue, PRIORITY_DAY, PRIORITY_WEEK, EVENT_MAX_ATTEMPTS
+from app.ingestion.parser import get_real_folder_path
+from app.ingestion.intake import SnapshotIntake, DownloadError, classify_snapshot
 
 log = logging.getLogger(__name__)
 
@@ -54,6 +56,9 @@ async def menu_choice(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.edit_message_text("Which day?", reply_markup=InlineKeyboardMarkup(kb))
         return GET_DAY
     
+    if choice == "plan_week":
+        return await plan_week(update, context)
+
     if choice == "upload_day":
         kb = [[InlineKeyboardButton(d.upper(), callback_data=f"setup_{d}")] for d in settings.TEACHING_DAYS]
         await query.edit_message_text("Upload for which day?", reply_markup=InlineKeyboardMarkup(kb))
@@ -96,49 +101,245 @@ async def run_workflow(update, context, day):
     # Determine chat_id
     if update.message: chat_id = update.message.chat_id
     else: chat_id = update.callback_query.message.chat_id
-    
-    await context.bot.send_message(chat_id, f"🚀 Starting workflow for {day.upper()}...")
 
-    # 1. Parser
-    await context.bot.send_message(chat_id, "Parsing data...")
-    success, res = run_parser(day)
-    if not success:
-        await context.bot.send_message(chat_id, f"❌ Parser failed: {res}")
+    # An upload intake has already parsed everything and hands over its records + session
+    records_file = context.user_data.pop('records_file', None)
+    session_id = context.user_data.pop('session_id', None)
+    if not records_file or not session_id:
+        session_id = datetime.now().strftime("%Y-%m-%d_%H-%M")
+    folder = settings.WEEK_SAVE_FOLDER if context.user_data.get('is_weekly') else day
+
+    if settings.JOB_QUEUE_ENABLED:
+        priority = PRIORITY_WEEK if context.user_data.get('is_weekly') else PRIORITY_DAY
+        payload = {'day': day, 'save_folder': folder, 'session_id': session_id, 'records_file': records_file}
+        await enqueue_plan(context, chat_id, payload, priority)
         return ConversationHandler.END
-        
-    # 2. Analyzer
-    await context.bot.send_message(chat_id, "Analyzing history...")
-    success, res = run_analyzer(day, settings.WEEK_SAVE_FOLDER)
+
+    async def notify(text):
+        await context.bot.send_message(chat_id, text)
+
+    async def send_document(path):
+        with open(path, 'rb') as f:
+            await context.bot.send_document(chat_id, document=f)
+
+    await run_day(day, folder, session_id, notify, send_document, records_file)
+    return ConversationHandler.END
+
+async def enqueue_plan(context, chat_id, payload, priority):
+    job_id, ahead = await asyncio.to_thread(job_queue().enqueue, 'plan_day', payload, chat_id, priority)
+    wait = f" ({ahead} job(s) ahead)" if ahead else ""
+    await context.bot.send_message(chat_id, f"⏳ {payload['day'].upper()} queued as job #{job_id}{wait}.")
+
+async def plan_week(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.edit_message_text("🚀 Planning the whole week...")
+    context.user_data['is_weekly'] = True
+    try:
+        for day in settings.TEACHING_DAYS:
+            await run_workflow(update, context, day)
+    finally:
+        context.user_data.pop('is_weekly', None)
+    return ConversationHandler.END
+
+# --- Setup/Upload Handlers ---
+# Each snapshot is downloaded and parsed in the background as soon as it arrives,
+# so pressing "Done" only leaves report assembly and the AI stages.
+
+async def setup_get_day(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    day = query.data.replace("setup_", "")
+    real_day_folder = get_real_folder_path(day)
+    os.makedirs(real_day_folder, exist_ok=True)
+
+    session_id = datetime.now().strftime("%Y-%m-%d_%H-%M")
+    context.user_data.update(day=day, session_id=session_id)
+    context.user_data['intake'] = SnapshotIntake(day, real_day_folder, session_id)
+
+    existing = [f for f in os.listdir(real_day_folder) if classify_snapshot(f)[0]]
+    if existing:
+        kb = [
+            [InlineKeyboardButton("🔄 Update (keep files I don't resend)", callback_data="setup_update")],
+            [InlineKeyboardButton("🗑 Replace all", callback_data="setup_replace")]
+        ]
+        await query.edit_message_text(f"{day.upper()} already has {len(existing)} snapshot files.", reply_markup=InlineKeyboardMarkup(kb))
+        return SETUP_CHECK_UPDATE
+
+    await query.edit_message_text(f"Send the sessions page for {day.upper()} ({settings.SESSIONS_FILENAME}).")
+    return SETUP_UPLOAD_SESSION
+
+async def setup_check_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    intake = context.user_data['intake']
+
+    if query.data == "setup_replace":
+        for item in os.listdir(intake.real_day_folder):
+            if classify_snapshot(item)[0]:
+                os.remove(os.path.join(intake.real_day_folder, item))
+    else:
+        # Start parsing what's already there while the coach sends the new files
+        intake.submit_existing()
+
+    if query.data == "setup_replace":
+        await query.edit_message_text(f"Send the sessions page for {intake.day_tag.upper()} ({settings.SESSIONS_FILENAME}).")
+        return SETUP_UPLOAD_SESSION
+    await query.edit_message_text("Send any snapshots that changed, then press Done.", reply_markup=done_keyboard())
+    return SETUP_UPLOAD_LOOP
+
+async def report_parse(context, chat_id, name, task):
+    success, res = await task
     if not success:
-        await context.bot.send_message(chat_id, f"⚠️ Analyzer warning: {res}")
+        await context.bot.send_message(chat_id, f"⚠️ {name} could not be parsed ({res}). Please resend it.")
 
-    # 3. Planner
-    await context.bot.send_message(chat_id, "Generating plans (AI)...")
-    folder = settings.WEEK_SAVE_FOLDER if context.user_data.get('is_weekly') else day
-    success, txt_path = run_planner(day, folder)
+async def receive_snapshot(update: Update, context: ContextTypes.DEFAULT_TYPE, document=None):
+    document = document or update.message.document
+    intake = context.user_data['intake']
+    chat_id = update.effective_chat.id
+    name = document.file_name or ""
+
+    if not classify_snapshot(name)[0]:
+        await context.bot.send_message(chat_id, f"❓ Skipped '{name}': expected e.g. 1600stage4register.mht or 1600stage4skill.mht.")
+        return None
+
+    try:
+        tg_file = await document.get_file()
+        task = await intake.receive(tg_file, name)
+    except Exception as e:
+        # Only DownloadError text is safe to log verbatim; never echo errors to the chat
+        log.error(f"Download of {name} failed: {e if isinstance(e, DownloadError) else type(e).__name__}")
+        await context.bot.send_message(chat_id, f"❌ Could not download {name}. Please resend it.")
+        return None
+    # Owned by the application so it is tracked and awaited on shutdown
+    context.application.create_task(report_parse(context, chat_id, name, task), update=update)
+    return task
+
+def done_keyboard():
+    return InlineKeyboardMarkup([[InlineKeyboardButton("✅ Done uploading", callback_data="setup_done")]])
+
+async def setup_upload_session(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    name = update.message.document.file_name or ""
+    if classify_snapshot(name)[0] != 'sessions':
+        await update.message.reply_text(f"Please send {settings.SESSIONS_FILENAME} first.")
+        return SETUP_UPLOAD_SESSION
+
+    task = await receive_snapshot(update, context)
+    if not task:
+        return SETUP_UPLOAD_SESSION
+    success, classes = await task
+    if not success:
+        return SETUP_UPLOAD_SESSION
+
+    expected = "\n".join(f"• {c['full_name']}: {c['time_key']}stage{c['stage_key']}register / skill" for c in classes)
+    await update.message.reply_text(
+        f"Found {len(classes)} classes:\n{expected}\n\nSend the register and skill snapshots, then press Done.",
+        reply_markup=done_keyboard())
+    return SETUP_UPLOAD_LOOP
+
+async def setup_upload_loop(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    document = update.message.document
+    intake = context.user_data['intake']
+    name = document.file_name or ""
+
+    if intake.has(name) and name.lower() in intake.received:
+        context.user_data['pending_duplicate'] = document
+        kb = [
+            [InlineKeyboardButton("Replace", callback_data="dup_replace")],
+            [InlineKeyboardButton("Keep first", callback_data="dup_keep")]
+        ]
+        await update.message.reply_text(f"{name} was already sent.", reply_markup=InlineKeyboardMarkup(kb))
+        return SETUP_HANDLE_DUPLICATE
+
+    if await receive_snapshot(update, context):
+        await update.message.reply_text(f"📥 {name} ({len(intake.received)} received)", reply_markup=done_keyboard())
+    return SETUP_UPLOAD_LOOP
+
+async def setup_handle_duplicate(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    document = context.user_data.pop('pending_duplicate', None)
+    if document and query.data == "dup_replace":
+        if await receive_snapshot(update, context, document):
+            await query.edit_message_text(f"🔄 Replaced {document.file_name}", reply_markup=done_keyboard())
+        else:
+            # receive_snapshot already said why; the earlier copy is untouched
+            await query.edit_message_text(f"Kept the first copy of {document.file_name}.", reply_markup=done_keyboard())
+    else:
+        await query.edit_message_text("Kept the first copy.", reply_markup=done_keyboard())
+    return SETUP_UPLOAD_LOOP
+
+async def setup_done(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    intake = context.user_data.pop('intake')
+    await query.edit_message_text("Assembling report...")
+
+    success, res, problems = await intake.assemble()
+    if problems:
+        await query.message.reply_text("⚠️ " + "\n⚠️ ".join(problems))
     if not success:
-        await context.bot.send_message(chat_id, f"❌ Planner failed: {txt_path}")
+        await query.message.reply_text(f"❌ Could not assemble report: {res}")
         return ConversationHandler.END
 
-    # 4. Beautifier
-    docx_path = txt_path.replace('.txt', '.docx')
-    success, res = run_beautifier(txt_path, docx_path)
-    
-    await context.bot.send_document(chat_id, document=open(docx_path if success else txt_path, 'rb'))
-    await context.bot.send_message(chat_id, "✅ Done!")
-    
-    return ConversationHandler.END
+    context.user_data['records_file'] = res
+    kb = [
+        [InlineKeyboardButton("Has Notes", callback_data="yes")],
+        [InlineKeyboardButton("No Notes", callback_data="no")]
+    ]
+    await query.message.reply_text(f"Notes for {intake.day_tag.upper()}?", reply_markup=InlineKeyboardMarkup(kb))
+    return SETUP_ASK_EXTRAS
+
+async def deliver_events(app):
+    """Forwards progress/results that worker processes leave in the job queue.
+    An event is only marked delivered after Telegram accepted it. When a send fails,
+    the rest of that chat's events wait for the next poll so each chat stays in order."""
+    queue = job_queue()
+    while True:
+        try:
+            blocked = set()     # chats with an undelivered earlier event this round
+            for event in await asyncio.to_thread(queue.pending_events):
+                if event['chat_id'] in blocked: continue
+                try:
+                    if event['kind'] == 'document':
+                        with open(event['body'], 'rb') as f:
+                            await app.bot.send_document(event['chat_id'], document=f)
+                    else:
+                        await app.bot.send_message(event['chat_id'], event['body'])
+                except RetryAfter as e:
+                    # Flood control applies to the whole bot, so stop the batch
+                    delay = e.retry_after
+                    delay = delay.total_seconds() if hasattr(delay, 'total_seconds') else delay
+                    log.warning(f"Flood control while delivering event #{event['id']}, waiting {delay}s")
+                    await asyncio.sleep(delay)
+                    break
+                except (Forbidden, BadRequest) as e:
+                    # Bot blocked / chat gone / message rejected: retrying won't help
+                    await asyncio.to_thread(queue.record_event_failure, event['id'], 1)
+                    log.error(f"Dropping event #{event['id']} for chat {event['chat_id']}: {e}")
+                    continue
+                except Exception as e:
+                    gave_up = await asyncio.to_thread(queue.record_event_failure, event['id'])
+                    if gave_up:
+                        log.error(f"Giving up on event #{event['id']} after {EVENT_MAX_ATTEMPTS} attempts: {e}")
+                    else:
+                        log.warning(f"Could not deliver event #{event['id']}, will retry: {e}")
+                        blocked.add(event['chat_id'])
+                    continue
+                await asyncio.to_thread(queue.mark_delivered, event['id'])
+        except Exception as e:
+            log.error(f"Event delivery error: {e}")
+        await asyncio.sleep(settings.WORKER_POLL_SECONDS)
 
-# --- Setup/Upload Handlers would go here (omitted for brevity, assume similar structure) ---
-# For the refactor, we focus on the core structure. The full upload logic is huge 
-# and should be ported similarly, but mapped to the new architecture.
+async def post_init(app):
+    if settings.JOB_QUEUE_ENABLED:
+        app.create_task(deliver_events(app))
 
 def main():
     if not settings.TELEGRAM_BOT_TOKEN:
         print("Error: No bot token in config.ini")
         return
 
-    app = Application.builder().token(settings.TELEGRAM_BOT_TOKEN).build()
+    app = Application.builder().token(settings.TELEGRAM_BOT_TOKEN).post_init(post_init).build()
 
     conv = ConversationHandler(
         entry_points=[CommandHandler('start', start)],
@@ -147,7 +348,18 @@ def main():
             GET_DAY: [CallbackQueryHandler(get_day)],
             GET_NOTES_DECISION: [CallbackQueryHandler(notes_decision)],
             RECEIVE_NOTES: [MessageHandler(filters.TEXT, receive_notes)],
-            # Add SETUP states here
+            SETUP_GET_DAY: [CallbackQueryHandler(setup_get_day, pattern="^setup_")],
+            SETUP_CHECK_UPDATE: [CallbackQueryHandler(setup_check_update, pattern="^setup_(update|replace)$")],
+            SETUP_UPLOAD_SESSION: [MessageHandler(filters.Document.ALL, setup_upload_session)],
+            SETUP_UPLOAD_LOOP: [
+                MessageHandler(filters.Document.ALL, setup_upload_loop),
+                CallbackQueryHandler(setup_done, pattern="^setup_done$")
+            ],
+            SETUP_HANDLE_DUPLICATE: [
+                CallbackQueryHandler(setup_handle_duplicate, pattern="^dup_"),
+                MessageHandler(filters.Document.ALL, setup_upload_loop)
+            ],
+            SETUP_ASK_EXTRAS: [CallbackQueryHandler(notes_decision)],
         },
         fallbacks=[CommandHandler('cancel', cancel)]
     )
@@ -25,6 +25,12 @@ class Settings:
         pdf_names = self._get('AI', 'PDF_KNOWLEDGE_BASE', '')
         self.PDF_KNOWLEDGE_BASE = [name.strip() for name in pdf_names.split(',') if name.strip()]
 
+        # 'single' = one request for the whole day, 'sharded' = one request per class in parallel
+        self.PLANNER_MODE = self._get('AI', 'PLANNER_MODE', 'single').strip().lower()
+        self.PLANNER_MAX_WORKERS = self._get_int('AI', 'PLANNER_MAX_WORKERS', 4)
+        self.PLANNER_SHARD_RETRIES = self._get_int('AI', 'PLANNER_SHARD_RETRIES', 2)
+        self.PLANNER_SHARD_TIMEOUT_SECONDS = self._get_int('AI', 'PLANNER_SHARD_TIMEOUT_SECONDS', 300)
+
         # System
         days_str = self._get('System', 'TEACHING_DAYS', 'mon,tue,thu')
         self.TEACHING_DAYS = [day.strip().lower() for day in days_str.split(',') if day.strip()]
@@ -35,6 +41,17 @@ class Settings:
         self.WEEKLY_NOTES_FILENAME = self._get('System', 'WEEKLY_NOTES_FILENAME', 'weekly_notes.txt')
         self.ADHOC_NOTES_FILENAME_TEMPLATE = self._get('System', 'ADHOC_NOTES_FILENAME', 'adhoc_notes.txt')
         
+        # Queue (bot enqueues, worker.py processes)
+        self.JOB_QUEUE_ENABLED = self._get_bool('Queue', 'ENABLED', False)
+        self.JOB_DB_FILENAME = self._get('Queue', 'DB_FILENAME', 'jobs.db')
+        self.WORKER_MAX_JOBS = self._get_int('Queue', 'WORKER_MAX_JOBS', 1)
+        self.WORKER_MIN_FREE_MB = self._get_int('Queue', 'WORKER_MIN_FREE_MB', 300)
+        self.WORKER_POLL_SECONDS = self._get_int('Queue', 'WORKER_POLL_SECONDS', 2)
+        self.JOB_STALE_SECONDS = self._get_int('Queue', 'JOB_STALE_SECONDS', 120)
+        self.JOB_MAX_ATTEMPTS = self._get_int('Queue', 'JOB_MAX_ATTEMPTS', 3)
+        self.JOB_TIMEOUT_SECONDS = self._get_int('Queue', 'JOB_TIMEOUT_SECONDS', 1800)
+        self.JOB_RETENTION_DAYS = self._get_int('Queue', 'JOB_RETENTION_DAYS', 14)
+        
         # Playwright
         self.PORTAL_URL = self._get('Playwright', 'PORTAL_URL', '')
         self.PORTAL_USERNAME = self._get('Playwright', 'PORTAL_USERNAME', '')
@@ -46,6 +63,12 @@ class Settings:
         except (configparser.NoSectionError, configparser.NoOptionError):
             return fallback
 
+    def _get_bool(self, section, key, fallback=False):
+        try:
+            return self.config.getboolean(section, key, fallback=fallback)
+        except (configparser.NoSectionError, configparser.NoOptionError, ValueError):
+            return fallback
+
     def _get_int(self, section, key, fallback=0):
         try:
             return self.config.getint(section, key, fallback=fallback)
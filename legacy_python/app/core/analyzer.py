@@ -1,13 +1,13 @@
 import google.generativeai as genai
 import os
-import glob
 import logging
 from datetime import datetime
 from app.config.settings import settings
+from app.ingestion.parser import render_report_file, history_reports
 
 log = logging.getLogger(__name__)
 
-def run_analyzer(day_tag, week_folder_tag, session_id=None):
+def run_analyzer(day_tag, week_folder_tag, session_id=None, report_file=None):
     log.info(f"Analyzing {day_tag} (Session: {session_id})...")
     
     # Configure GenAI
@@ -28,8 +28,15 @@ def run_analyzer(day_tag, week_folder_tag, session_id=None):
     
     # 1. Look for the current session's report FIRST (Critical for flow correctness)
     current_report = None
-    if session_id:
+    if report_file and os.path.exists(report_file):
+        # Explicit report handed over by the pipeline (may be a reused one from an earlier session)
+        current_report = report_file
+        report_files.append(current_report)
+    elif session_id:
         expected_report = os.path.join(real_day_folder, f"full_class_report-{day_tag}_{session_id}.txt")
+        records = os.path.join(real_day_folder, f"class_records-{day_tag}_{session_id}.jsonl")
+        if not os.path.exists(expected_report) and os.path.exists(records):
+            render_report_file(records)
         if os.path.exists(expected_report):
             current_report = expected_report
             report_files.append(current_report)
@@ -42,14 +49,14 @@ def run_analyzer(day_tag, week_folder_tag, session_id=None):
     if current_report: processed.add(current_report)
     
     found_historicals = []
-    for f in glob.glob(os.path.join(real_day_folder, f"full_class_report-{day_tag}_*.txt")):
+    for f in history_reports(real_day_folder, day_tag):
         if f not in processed:
             found_historicals.append(f)
             processed.add(f)
     
     # Secondary (Week folder)
     if os.path.isdir(week_folder_tag):
-        for f in glob.glob(os.path.join(week_folder_tag, f"full_class_report-{day_tag}_*.txt")):
+        for f in history_reports(week_folder_tag, day_tag):
             if f not in processed:
                 found_historicals.append(f)
                 processed.add(f)
@@ -0,0 +1,222 @@
+import os
+import json
+import asyncio
+import hashlib
+import logging
+from app.config.settings import settings
+from app.ingestion.parser import run_parser, render_report_file, history_reports, get_real_folder_path
+from app.core.analyzer import run_analyzer
+from app.core.planner import (
+    resolve_planner_folders, find_analysis_file, upload_planner_files, generate_plans, generate_plans_sharded
+)
+from app.core.beautifier import run_beautifier
+
+log = logging.getLogger(__name__)
+
+CACHE_FILENAME = ".pipeline_cache.json"
+
+class Stage:
+    def __init__(self, name, func, deps=(), inputs=None, required=True, label=None):
+        self.name = name
+        self.func = func            # func(results) -> (success, value)
+        self.deps = tuple(deps)
+        self.inputs = inputs        # inputs(results) -> [paths]; enables output reuse
+        self.required = required    # if False, dependants still run when this stage fails
+        self.label = label
+
+class Pipeline:
+    """Tiny task-graph executor.
+
+    Stages run as soon as their dependencies finish, so independent stages overlap.
+    Stages that declare their input files have their (file) output reused while
+    those inputs are unchanged.
+    """
+    def __init__(self, cache_path=None):
+        self.stages = {}
+        self.cache_path = cache_path
+        self.cache = self._load_cache()
+
+    def add(self, name, func, deps=(), inputs=None, required=True, label=None):
+        for dep in deps:
+            if dep not in self.stages:
+                raise ValueError(f"Stage '{name}' depends on unknown stage '{dep}'")
+        self.stages[name] = Stage(name, func, deps, inputs, required, label)
+
+    async def run(self, notify=None):
+        """Returns {stage_name: (success, value)}; skipped stages map to (False, reason)."""
+        outcomes = {}
+        results = {}
+        tasks = {}
+        for name, stage in self.stages.items():
+            tasks[name] = asyncio.create_task(self._run_stage(stage, tasks, outcomes, results, notify))
+        await asyncio.gather(*tasks.values())
+        self._save_cache()
+        return outcomes
+
+    async def _run_stage(self, stage, tasks, outcomes, results, notify):
+        for dep in stage.deps:
+            await tasks[dep]
+            if not outcomes[dep][0] and self.stages[dep].required:
+                outcomes[stage.name] = (False, f"Skipped: '{dep}' failed")
+                return
+
+        fingerprint = None
+        if stage.inputs:
+            try:
+                fingerprint = self._fingerprint(stage.inputs(results))
+            except Exception as e:
+                log.warning(f"[{stage.name}] could not fingerprint inputs: {e}")
+            cached = self.cache.get(stage.name)
+            if fingerprint and cached and cached.get('fingerprint') == fingerprint and os.path.exists(cached.get('output', '')):
+                log.info(f"[{stage.name}] inputs unchanged, reusing {cached['output']}")
+                outcomes[stage.name] = (True, cached['output'])
+                results[stage.name] = cached['output']
+                return
+
+        if notify and stage.label:
+            # Progress messages are best-effort; a failed send must not abort the plan
+            try:
+                await notify(stage.label)
+            except Exception as e:
+                log.warning(f"[{stage.name}] progress message failed: {e}")
+
+        try:
+            success, value = await asyncio.to_thread(stage.func, results)
+        except Exception as e:
+            log.error(f"[{stage.name}] crashed: {e}")
+            success, value = False, str(e)
+
+        outcomes[stage.name] = (success, value)
+        if success:
+            results[stage.name] = value
+            if fingerprint and isinstance(value, str) and os.path.exists(value):
+                self.cache[stage.name] = {'fingerprint': fingerprint, 'output': value}
+        else:
+            log.warning(f"[{stage.name}] failed: {value}")
+
+    def _fingerprint(self, paths):
+        h = hashlib.sha1()
+        for path in sorted(set(p for p in paths if p)):
+            try:
+                st = os.stat(path)
+                h.update(f"{path}|{st.st_size}|{st.st_mtime_ns}\n".encode())
+            except OSError:
+                h.update(f"{path}|missing\n".encode())
+        return h.hexdigest()
+
+    def _load_cache(self):
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return {}
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            log.warning(f"Ignoring unreadable pipeline cache {self.cache_path}: {e}")
+            return {}
+
+    def _save_cache(self):
+        if not self.cache_path: return
+        try:
+            with open(self.cache_path, 'w', encoding='utf-8') as f:
+                json.dump(self.cache, f, indent=2)
+        except Exception as e:
+            log.warning(f"Could not write pipeline cache {self.cache_path}: {e}")
+
+def snapshot_files(real_day_folder):
+    return [os.path.join(real_day_folder, f) for f in os.listdir(real_day_folder)
+            if f.lower().endswith(('.mht', '.mhtml'))]
+
+def history_files(real_day_folder, day_tag):
+    files = history_reports(real_day_folder, day_tag)
+    if os.path.isdir(settings.WEEK_SAVE_FOLDER):
+        files += history_reports(settings.WEEK_SAVE_FOLDER, day_tag)
+    return files
+
+def build_day_pipeline(day_tag, save_folder_tag, session_id, records_file=None):
+    """parse -> render -> (analyze || uploads) -> generate -> beautify
+
+    `records_file` comes from the upload intake, which has already parsed every
+    snapshot; the parse stage then just hands it on."""
+    real_day_folder = get_real_folder_path(day_tag)
+    _, real_save_folder = resolve_planner_folders(day_tag, save_folder_tag)
+    real_save_folder = real_save_folder or real_day_folder
+
+    sharded = settings.PLANNER_MODE == 'sharded'
+
+    def generate(r):
+        """Value is (plan_path, classes_that_could_not_be_planned) in both modes."""
+        analysis_file = r.get('analyze') or find_analysis_file(real_day_folder, day_tag)
+        if sharded:
+            return generate_plans_sharded(day_tag, real_save_folder, r['uploads'], r['parse'], analysis_file, session_id)
+        success, res = generate_plans(day_tag, real_save_folder, r['uploads'], analysis_file, session_id)
+        return success, (res, []) if success else res
+
+    pipeline = Pipeline(cache_path=os.path.join(real_day_folder, CACHE_FILENAME))
+
+    if records_file:
+        pipeline.add('parse', lambda r: (True, records_file))
+    else:
+        pipeline.add('parse',
+            lambda r: run_parser(day_tag, session_id),
+            inputs=lambda r: snapshot_files(real_day_folder),
+            label="Parsing data...")
+
+    # Markdown for the model is rendered from the parser's records only when needed
+    pipeline.add('render',
+        lambda r: render_report_file(r['parse']),
+        deps=['parse'],
+        inputs=lambda r: [r['parse']])
+
+    pipeline.add('analyze',
+        lambda r: run_analyzer(day_tag, settings.WEEK_SAVE_FOLDER, session_id, report_file=r['render']),
+        deps=['render'],
+        inputs=lambda r: [r['render'], settings.ANALYZER_PROMPT_FILE] + history_files(real_day_folder, day_tag),
+        required=False,
+        label="Analyzing history...")
+
+    pipeline.add('uploads',
+        lambda r: upload_planner_files(day_tag, r['render'], include_report=not sharded),
+        deps=['render'],
+        label="Uploading knowledge base & notes...")
+
+    pipeline.add('generate',
+        generate,
+        deps=['analyze', 'uploads'],
+        label="Generating plans (AI)...")
+
+    pipeline.add('beautify',
+        lambda r: run_beautifier(r['generate'][0], r['generate'][0].replace('.txt', '.docx')),
+        deps=['generate'],
+        required=False)
+
+    return pipeline
+
+async def run_day(day_tag, save_folder_tag, session_id, notify, send_document, records_file=None):
+    """Runs the day pipeline and reports through `notify(text)` / `send_document(path)`.
+    Shared by the bot (inline mode) and the job worker."""
+    await notify(f"🚀 Starting workflow for {day_tag.upper()}...")
+    outcomes = await build_day_pipeline(day_tag, save_folder_tag, session_id, records_file).run(notify=notify)
+
+    success, res = outcomes['parse']
+    if not success:
+        await notify(f"❌ Parser failed: {res}")
+        return False, res
+
+    success, res = outcomes['analyze']
+    if not success:
+        await notify(f"⚠️ Analyzer warning: {res}")
+
+    for stage in ('uploads', 'generate'):
+        success, res = outcomes[stage]
+        if not success:
+            await notify(f"❌ Planner failed: {res}")
+            return False, res
+
+    txt_path, failed_classes = outcomes['generate'][1]
+    if failed_classes:
+        await notify(f"⚠️ {len(failed_classes)} class(es) could not be planned: {', '.join(failed_classes)}")
+    success, docx_path = outcomes['beautify']
+
+    await send_document(docx_path if success else txt_path)
+    await notify("✅ Done!")
+    return True, docx_path if success else txt_path
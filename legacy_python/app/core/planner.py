@@ -1,34 +1,16 @@
 import google.generativeai as genai
 import os
-import glob
+import re
+import time
 import logging
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from datetime import datetime, timedelta
 from app.config.settings import settings
+from app.ingestion.parser import render_class_sections
 
 log = logging.getLogger(__name__)
 
-def find_latest_report(real_day_folder, day_tag, session_id=None):
-    # If session_id provided, look for exact match FIRST
-    if session_id:
-        expected = os.path.join(real_day_folder, f"full_class_report-{day_tag}_{session_id}.txt")
-        if os.path.exists(expected):
-            return expected
-        log.warning(f"Planner could not find report for session {session_id}. Falling back to latest.")
-
-    try:
-        files = glob.glob(os.path.join(real_day_folder, f"full_class_report-{day_tag}_*.txt"))
-        if not files: return None
-        return max(files, key=os.path.getmtime)
-    except: return None
-
-def run_planner(day_tag, save_folder_tag, session_id=None):
-    log.info(f"Planning for {day_tag} (Session: {session_id})...")
-    
-    try:
-        genai.configure(api_key=settings.GEMINI_API_KEY)
-    except Exception as e:
-        return False, f"API Key Error: {e}"
-
+def resolve_planner_folders(day_tag, save_folder_tag):
     real_day_folder = None
     real_save_folder = None
     
@@ -37,52 +19,69 @@ def run_planner(day_tag, save_folder_tag, session_id=None):
             if item.lower() == day_tag.lower(): real_day_folder = item
             if item.lower() == save_folder_tag.lower(): real_save_folder = item
     
-    if not real_day_folder: return False, f"Day folder {day_tag} not found"
-    if not real_save_folder: real_save_folder = real_day_folder # Fallback
-
-    report_file = find_latest_report(real_day_folder, day_tag, session_id)
-    if not report_file: return False, f"No recent report found for {day_tag}"
+    if real_day_folder and not real_save_folder: real_save_folder = real_day_folder # Fallback
+    return real_day_folder, real_save_folder
 
+def find_analysis_file(real_day_folder, day_tag, session_id=None):
     # Look for specific analysis file if session_id exists
     suffix = session_id if session_id else ""
     # Try finding one with the session_id first (suffix logic varies, we used _session_id in analyzer)
     potential_analysis = os.path.join(real_day_folder, f"long_term_analysis-{day_tag}_{suffix}.txt")
     
-    analysis_file = None
     if os.path.exists(potential_analysis):
-        analysis_file = potential_analysis
-    else:
-        # Fallback to generic latest check or legacy name
-        legacy_name = os.path.join(real_day_folder, f"long_term_analysis-{day_tag}.txt")
-        if os.path.exists(legacy_name):
-            analysis_file = legacy_name
-    
-    # Uploads
+        return potential_analysis
+    # Fallback to generic latest check or legacy name
+    legacy_name = os.path.join(real_day_folder, f"long_term_analysis-{day_tag}.txt")
+    if os.path.exists(legacy_name):
+        return legacy_name
+    return None
+
+def upload_planner_files(day_tag, report_file, include_report=True):
+    """Uploads everything the planner needs that does NOT depend on the analyzer.
+    Sharded planning sends each class inline instead, so it skips the full report."""
+    try:
+        genai.configure(api_key=settings.GEMINI_API_KEY)
+    except Exception as e:
+        return False, f"API Key Error: {e}"
+
     files_to_send = []
-    
-    # PDFs
-    for pdf in settings.PDF_KNOWLEDGE_BASE:
-        if os.path.exists(pdf):
-            files_to_send.append(genai.upload_file(path=pdf))
-    
-    files_to_send.append(genai.upload_file(path=report_file))
-    
-    if analysis_file:
-        files_to_send.append(genai.upload_file(path=analysis_file))
-        
-    if os.path.exists(settings.WEEKLY_NOTES_FILENAME):
-        files_to_send.append(genai.upload_file(path=settings.WEEKLY_NOTES_FILENAME))
+    try:
+        # PDFs
+        for pdf in settings.PDF_KNOWLEDGE_BASE:
+            if os.path.exists(pdf):
+                files_to_send.append(genai.upload_file(path=pdf))
         
-    adhoc = settings.ADHOC_NOTES_FILENAME_TEMPLATE.replace('.txt', f'-{day_tag}.txt')
-    if os.path.exists(adhoc):
-        files_to_send.append(genai.upload_file(path=adhoc))
+        if include_report:
+            files_to_send.append(genai.upload_file(path=report_file))
+            
+        if os.path.exists(settings.WEEKLY_NOTES_FILENAME):
+            files_to_send.append(genai.upload_file(path=settings.WEEKLY_NOTES_FILENAME))
+            
+        adhoc = settings.ADHOC_NOTES_FILENAME_TEMPLATE.replace('.txt', f'-{day_tag}.txt')
+        if os.path.exists(adhoc):
+            files_to_send.append(genai.upload_file(path=adhoc))
+    except Exception as e:
+        return False, f"Upload Error: {e}"
+
+    return True, files_to_send
+
+def generate_plans(day_tag, real_save_folder, files_to_send, analysis_file=None, session_id=None):
+    """Final model call. `files_to_send` comes from upload_planner_files."""
+    try:
+        genai.configure(api_key=settings.GEMINI_API_KEY)
+    except Exception as e:
+        return False, f"API Key Error: {e}"
 
     try:
+        parts = list(files_to_send)
+        if analysis_file:
+            parts.append(genai.upload_file(path=analysis_file))
+
         with open(settings.PLANNER_PROMPT_FILE, 'r') as f:
             prompt = f.read()
 
         model = genai.GenerativeModel(model_name=settings.PLANNER_MODEL)
-        response = model.generate_content([prompt] + files_to_send)
+        response = model.generate_content([prompt] + parts)
         
         ts = session_id if session_id else datetime.now().strftime("%Y-%m-%d_%H-%M")
         output_file = os.path.join(real_save_folder, f"lesson_plans_output-{day_tag}_{ts}.txt")
@@ -94,3 +93,121 @@ def run_planner(day_tag, save_folder_tag, session_id=None):
 
     except Exception as e:
         return False, str(e)
+
+def split_report_by_class(report_text):
+    """Splits a full_class_report into one '# Class Report:' section per class."""
+    sections = re.split(r'(?m)^(?=# Class Report:)', report_text)
+    return [sec.strip() for sec in sections if sec.strip().startswith('# Class Report:')]
+
+def load_class_sections(report_file):
+    """(class_name, markdown) per class, straight from parser records when given a .jsonl file."""
+    if report_file.endswith('.jsonl'):
+        return render_class_sections(report_file)
+    with open(report_file, 'r', encoding='utf-8') as f:
+        return [(class_name_of(sec), sec) for sec in split_report_by_class(f.read())]
+
+def class_name_of(section):
+    return section.splitlines()[0].replace('# Class Report:', '').strip()
+
+def session_time_key(class_name):
+    match = re.match(r'(\d{1,2}):(\d{2})', class_name)
+    if not match: return (99, 99)
+    return (int(match.group(1)), int(match.group(2)))
+
+def create_shared_model(prompt, shared_parts):
+    """Caches the prompt + knowledge base once so each shard only sends its own class.
+    Context caching has a minimum size and needs a versioned model, so fall back to
+    plain requests (sharing the already uploaded files) when it is not available."""
+    try:
+        from google.generativeai import caching
+        cache = caching.CachedContent.create(
+            model=settings.PLANNER_MODEL,
+            system_instruction=prompt,
+            contents=shared_parts,
+            ttl=timedelta(minutes=30),
+        )
+        return genai.GenerativeModel.from_cached_content(cached_content=cache), [], cache
+    except Exception as e:
+        log.info(f"Context cache unavailable, sending shared context per shard: {e}")
+        return genai.GenerativeModel(model_name=settings.PLANNER_MODEL), [prompt] + shared_parts, None
+
+def generate_plans_sharded(day_tag, real_save_folder, files_to_send, report_file, analysis_file=None, session_id=None):
+    """Map-reduce planning: one model call per class, run concurrently, failed shards retried.
+    Returns (True, (output_file, failed_class_names)) when at least one class was planned."""
+    try:
+        genai.configure(api_key=settings.GEMINI_API_KEY)
+    except Exception as e:
+        return False, f"API Key Error: {e}"
+
+    try:
+        sections = load_class_sections(report_file)
+        if not sections: return False, f"No class sections found in {report_file}"
+
+        shared_parts = list(files_to_send)
+        if analysis_file:
+            shared_parts.append(genai.upload_file(path=analysis_file))
+
+        with open(settings.PLANNER_PROMPT_FILE, 'r') as f:
+            prompt = f.read()
+    except Exception as e:
+        return False, str(e)
+
+    model, prefix, cache = create_shared_model(prompt, shared_parts)
+
+    def plan_shard(shard):
+        _, section = shard
+        text = f"Current report (this class ONLY - plan just this one class):\n\n{section}"
+        return model.generate_content(prefix + [text]).text
+
+    plans, errors = {}, {}
+    pending = list(range(len(sections)))
+    # Not a `with` block: leaving it would wait on any shard call that hangs
+    pool = ThreadPoolExecutor(max_workers=max(1, settings.PLANNER_MAX_WORKERS))
+    try:
+        for attempt in range(1 + settings.PLANNER_SHARD_RETRIES):
+            if not pending: break
+            if attempt:
+                log.warning(f"Retrying {len(pending)} failed class(es) (attempt {attempt + 1})")
+                time.sleep(2 ** attempt)
+            futures = {i: pool.submit(plan_shard, sections[i]) for i in pending}
+            deadline = time.monotonic() + settings.PLANNER_SHARD_TIMEOUT_SECONDS
+            pending = []
+            for i, future in futures.items():
+                try:
+                    plans[i] = future.result(timeout=max(0, deadline - time.monotonic()))
+                    errors.pop(i, None)
+                except FutureTimeout:
+                    future.cancel()
+                    log.error(f"Planning timed out for {sections[i][0]}")
+                    errors[i] = f"timed out after {settings.PLANNER_SHARD_TIMEOUT_SECONDS}s"
+                    pending.append(i)
+                except Exception as e:
+                    log.error(f"Planning failed for {sections[i][0]}: {e}")
+                    errors[i] = str(e)
+                    pending.append(i)
+    finally:
+        pool.shutdown(wait=False)
+        if cache:
+            try: cache.delete()
+            except Exception: pass
+
+    if not plans:
+        return False, f"All {len(sections)} class plans failed: {next(iter(errors.values()))}"
+
+    merged = []
+    for i in sorted(range(len(sections)), key=lambda i: session_time_key(sections[i][0])):
+        if i in plans:
+            merged.append(plans[i].strip())
+        else:
+            merged.append(f"--- [Processing: {sections[i][0]}] ---\n"
+                          f"⚠️ Plan generation failed for this class: {errors[i]}")
+
+    try:
+        ts = session_id if session_id else datetime.now().strftime("%Y-%m-%d_%H-%M")
+        output_file = os.path.join(real_save_folder, f"lesson_plans_output-{day_tag}_{ts}.txt")
+        with open(output_file, "w", encoding="utf-8") as f:
+            f.write("\n\n---\n\n".join(merged))
+        failed = [sections[i][0] for i in sorted(errors, key=lambda i: session_time_key(sections[i][0]))]
+        return True, (output_file, failed)
+    except Exception as e:
+        return False, str(e)
@@ -0,0 +1,178 @@
+import re
+import os
+import copy
+import shutil
+import asyncio
+import logging
+import multiprocessing
+import httpx
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from app.config.settings import settings
+from app.ingestion.parser import (
+    get_html_from_mhtml, parse_all_classes, parse_student_percentages, extract_skill_statuses,
+    merge_skill_statuses, build_class_records, write_records
+)
+
+log = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+SNAPSHOT_PATTERN = re.compile(r'^(\d+)stage([a-z0-9]+?)(register|skill)(?:-(\d+))?\.mht(?:ml)?$', re.IGNORECASE)
+
+# Shared by every intake so a couple of coaches uploading at once can't swamp the Pi
+_parse_pool = None
+
+def parse_pool():
+    """With the job queue on, the bot process only relays messages, so snapshot parsing
+    (lxml) runs in child processes: a huge snapshot kills a child, not the bot.
+    Inline mode already runs the whole plan in the bot and keeps using threads."""
+    global _parse_pool
+    if _parse_pool is None:
+        if settings.JOB_QUEUE_ENABLED:
+            # spawn: forking a process that is running an event loop and threads is unsafe
+            _parse_pool = ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context('spawn'))
+        else:
+            _parse_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="intake")
+    return _parse_pool
+
+async def parse_in_pool(path):
+    global _parse_pool
+    pool = parse_pool()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(pool, parse_snapshot, path)
+    except BrokenProcessPool:
+        # A child died (e.g. out of memory); start a fresh pool for the next file
+        log.error(f"Parser process died while parsing {os.path.basename(path)}")
+        if _parse_pool is pool:
+            _parse_pool = None
+        return False, "the parser ran out of memory or crashed"
+
+def classify_snapshot(filename):
+    """('sessions', None) | ('register', (time, stage)) | ('skill', (time, stage, page)) | (None, None)"""
+    name = filename.lower()
+    sessions_base = os.path.splitext(settings.SESSIONS_FILENAME.lower())[0]
+    if name in (f"{sessions_base}.mht", f"{sessions_base}.mhtml"):
+        return 'sessions', None
+    match = SNAPSHOT_PATTERN.match(name)
+    if not match:
+        return None, None
+    time_key, stage_key, kind, page = match.groups()
+    if kind == 'register':
+        return 'register', (time_key, stage_key)
+    return 'skill', (time_key, stage_key, int(page) if page else 0)
+
+def parse_snapshot(path):
+    """Validates and parses a single snapshot. Returns (success, data_or_error)."""
+    kind, _ = classify_snapshot(os.path.basename(path))
+    html = get_html_from_mhtml(path)
+    if not html:
+        return False, "not a readable MHTML snapshot"
+    if kind == 'sessions':
+        classes = parse_all_classes(html)
+        return (True, classes) if classes else (False, "no classes found in sessions page")
+    if kind == 'register':
+        students = parse_student_percentages(html)
+        return (True, students) if students else (False, "no students found in register page")
+    if kind == 'skill':
+        return True, extract_skill_statuses(html)
+    return False, "unrecognised file name"
+
+class DownloadError(Exception):
+    """Download failure whose message never contains the file URL (it embeds the bot token)."""
+
+async def download_in_chunks(tg_file, dest_path):
+    """Streams a Telegram file to disk without holding it in memory."""
+    tmp_path = dest_path + ".part"
+    try:
+        if os.path.exists(tg_file.file_path):
+            # Local Bot API server hands out paths on disk
+            shutil.copyfile(tg_file.file_path, tmp_path)
+        else:
+            async with httpx.AsyncClient(timeout=60) as client:
+                async with client.stream('GET', tg_file.file_path) as response:
+                    if response.is_error:
+                        raise DownloadError(f"download failed ({response.status_code})")
+                    with open(tmp_path, 'wb') as f:
+                        async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                            f.write(chunk)
+        os.replace(tmp_path, dest_path)
+        return dest_path
+    except httpx.HTTPError as e:
+        raise DownloadError(f"download failed ({type(e).__name__})") from None
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+class SnapshotIntake:
+    """Collects one day's snapshots as they arrive and parses each in the background,
+    so finishing the upload only leaves report assembly + the AI stages."""
+
+    def __init__(self, day_tag, real_day_folder, session_id):
+        self.day_tag = day_tag
+        self.real_day_folder = real_day_folder
+        self.session_id = session_id
+        self.tasks = {}     # lower-case filename -> asyncio.Task resolving to (success, data)
+        self.received = set()   # names sent during this intake (vs. already on disk)
+
+    def has(self, filename):
+        return filename.lower() in self.tasks
+
+    def submit(self, path):
+        """Starts parsing a file that is already on disk; replaces any earlier copy."""
+        task = asyncio.get_running_loop().create_task(parse_in_pool(path))
+        self.tasks[os.path.basename(path).lower()] = task
+        return task
+
+    async def receive(self, tg_file, filename):
+        """Downloads then queues parsing. Returns the parse task (awaiting it is optional)."""
+        dest = os.path.join(self.real_day_folder, filename)
+        await download_in_chunks(tg_file, dest)
+        self.received.add(filename.lower())
+        return self.submit(dest)
+
+    def submit_existing(self):
+        """Queues snapshots already in the day folder (update mode) that weren't re-sent."""
+        for item in os.listdir(self.real_day_folder):
+            kind, _ = classify_snapshot(item)
+            if kind and not self.has(item):
+                self.submit(os.path.join(self.real_day_folder, item))
+
+    async def sessions(self):
+        for name, task in self.tasks.items():
+            if classify_snapshot(name)[0] == 'sessions':
+                return await task
+        return False, f"Sessions file {settings.SESSIONS_FILENAME} not received"
+
+    async def assemble(self):
+        """Waits for outstanding parses and writes the session's class_records file."""
+        success, classes = await self.sessions()
+        if not success: return False, classes, []
+
+        registers, skills, problems = {}, {}, []
+        for name, task in list(self.tasks.items()):
+            kind, key = classify_snapshot(name)
+            ok, data = await task
+            if not ok:
+                if kind != 'sessions': problems.append(f"{name}: {data}")
+                continue
+            if kind == 'register':
+                registers[key] = data
+            elif kind == 'skill':
+                skills.setdefault(key[:2], {})[key[2]] = data
+
+        records = []
+        for class_info in classes:
+            key = (class_info['time_key'], class_info['stage_key'])
+            if key not in registers:
+                problems.append(f"{class_info['full_name']}: no register uploaded")
+            students = copy.deepcopy(registers.get(key, {}))
+            for page in sorted(skills.get(key, {})):
+                students = merge_skill_statuses(students, skills[key][page])
+            records.extend(build_class_records(class_info, students))
+
+        output_filename = os.path.join(self.real_day_folder, f"class_records-{self.day_tag}_{self.session_id}.jsonl")
+        try:
+            write_records(output_filename, records)
+            return True, output_filename, problems
+        except Exception as e:
+            return False, str(e), problems
@@ -1,6 +1,7 @@
 import re
 import os
 import glob
+import json
 import logging
 from email import message_from_bytes
 from email.policy import default
@@ -96,7 +97,9 @@ def parse_student_percentages(html_content):
         log.error(f"Error parsing percentages: {e}")
         return {}
 
-def parse_skill_objectives(html_content, students_dict):
+def extract_skill_statuses(html_content):
+    """[(student_name, objective, status)] from one skill page; needs no register, so it can run eagerly."""
+    statuses = []
     try:
         soup = BeautifulSoup(html_content, 'lxml')
         skill_groups = soup.find_all('div', class_='v-list-group')
@@ -113,12 +116,20 @@ def parse_skill_objectives(html_content, students_dict):
                 student_name = name_raw.split(' (Stage')[0].strip()
                 status_btn = row.find('button', class_='v-item--active')
                 status = status_btn.get_text(strip=True) if status_btn else "Not Assessed"
-                if student_name in students_dict:
-                    students_dict[student_name]['skills'].append({'objective': objective_title, 'status': status})
-        return students_dict
+                statuses.append((student_name, objective_title, status))
+        return statuses
     except Exception as e:
         log.error(f"Error parsing skills: {e}")
-        return students_dict
+        return statuses
+
+def parse_skill_objectives(html_content, students_dict):
+    return merge_skill_statuses(students_dict, extract_skill_statuses(html_content))
+
+def merge_skill_statuses(students_dict, statuses):
+    for student_name, objective, status in statuses:
+        if student_name in students_dict:
+            students_dict[student_name]['skills'].append({'objective': objective, 'status': status})
+    return students_dict
 
 def format_data_for_ai(class_name, students_data):
     report_lines = [f"# Class Report: {class_name}\n", "## Student Progress Summary\n"]
@@ -140,6 +151,86 @@ def format_data_for_ai(class_name, students_data):
         report_lines.append("\n")
     return "\n".join(report_lines)
 
+# --- Structured records (canonical parser output) ---
+# One JSON object per line, one line per student (a class with no students gets a
+# single row with student=None so it still shows up in reports):
+# {"class": "16:00 Stage 4", "time_key": "1600", "stage_key": "4", "student": "Jo Bloggs",
+#  "display_name": "Jo Bloggs (Stage 4)", "overall_pct": 98.0, "skills": {"1. Push and glide...": "Pass"}}
+
+def parse_percentage(text):
+    match = re.search(r'\d+(?:\.\d+)?', text or '')
+    return float(match.group()) if match else None
+
+def build_class_records(class_info, students_data):
+    base = {'class': class_info['full_name'], 'time_key': class_info['time_key'], 'stage_key': class_info['stage_key']}
+    if not students_data:
+        return [dict(base, student=None, display_name=None, overall_pct=None, skills={})]
+    rows = []
+    for student_name in sorted(students_data.keys()):
+        student = students_data[student_name]
+        rows.append(dict(base,
+            student=student_name,
+            display_name=student.get('display_name', student_name),
+            overall_pct=parse_percentage(student['overall_progress']),
+            skills={skill['objective']: skill['status'] for skill in student['skills']},
+        ))
+    return rows
+
+def write_records(path, rows):
+    with open(path, 'w', encoding='utf-8') as f:
+        for row in rows:
+            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+def read_records(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def group_records_by_class(rows):
+    """Returns [(class_name, students_data)] in session order, in the shape format_data_for_ai expects."""
+    classes = {}
+    for row in rows:
+        students = classes.setdefault(row['class'], {})
+        if row['student'] is None: continue
+        pct = row['overall_pct']
+        students[row['student']] = {
+            'overall_progress': f"{pct:g}%" if pct is not None else "N/A",
+            'display_name': row['display_name'],
+            'skills': [{'objective': o, 'status': st} for o, st in row['skills'].items()],
+        }
+    return list(classes.items())
+
+def render_class_sections(records_path):
+    """Markdown for the model, one section per class, rendered on demand from the records."""
+    return [(name, format_data_for_ai(name, students)) for name, students in group_records_by_class(read_records(records_path))]
+
+def report_path_for(records_path):
+    folder, name = os.path.split(records_path)
+    return os.path.join(folder, name.replace('class_records-', 'full_class_report-', 1).replace('.jsonl', '.txt'))
+
+def render_report_file(records_path):
+    """Renders (or reuses) the markdown full_class_report next to a records file."""
+    report_path = report_path_for(records_path)
+    try:
+        if os.path.exists(report_path) and os.path.getmtime(report_path) >= os.path.getmtime(records_path):
+            return True, report_path
+        sections = render_class_sections(records_path)
+        if not sections: return False, f"No records in {records_path}"
+        with open(report_path, "w", encoding="utf-8") as f:
+            f.write("\n\n".join(text for _, text in sections))
+        return True, report_path
+    except Exception as e:
+        return False, str(e)
+
+def history_reports(folder, day_tag):
+    """Every full_class_report for a day in `folder`, rendering any session that so far only has records."""
+    for records_path in glob.glob(os.path.join(folder, f"class_records-{day_tag}_*.jsonl")):
+        success, res = render_report_file(records_path)
+        if not success:
+            log.warning(f"Could not render history from {records_path}: {res}")
+    return glob.glob(os.path.join(folder, f"full_class_report-{day_tag}_*.txt"))
+
 def run_parser(day_tag, session_id):
     log.info(f"--- Running Parser for {day_tag} (Session: {session_id}) ---")
     real_day_folder = get_real_folder_path(day_tag)
@@ -151,6 +242,7 @@ def run_parser(day_tag, session_id):
     try:
         cutoff = datetime.now() - timedelta(days=settings.FILE_RETENTION_DAYS)
         patterns = [
+            os.path.join(real_day_folder, "class_records-*.jsonl"),
             os.path.join(real_day_folder, "full_class_report-*.txt"),
             os.path.join(real_day_folder, "lesson_plans_output-*.txt"),
             os.path.join(real_day_folder, "long_term_analysis-*.txt")
@@ -168,7 +260,7 @@ def run_parser(day_tag, session_id):
         log.warning(f"Housekeeping error: {e}")
 
     # Output filename now strictly uses session_id (which should be a timestamp string)
-    output_filename = os.path.join(real_day_folder, f"full_class_report-{day_tag}_{session_id}.txt")
+    output_filename = os.path.join(real_day_folder, f"class_records-{day_tag}_{session_id}.jsonl")
     
     sessions_path = find_insensitive_path(real_day_folder, settings.SESSIONS_FILENAME)
     if not sessions_path:
@@ -180,10 +272,9 @@ def run_parser(day_tag, session_id):
     if not all_classes:
         return False, "No classes parsed from sessions file"
 
-    final_report_content = []
+    records = []
     
     for class_info in all_classes:
-        class_name = class_info['full_name']
         stage_key = class_info['stage_key']
         time_key = class_info['time_key']
 
@@ -224,15 +315,13 @@ def run_parser(day_tag, session_id):
             if html:
                 students_data = parse_skill_objectives(html, students_data)
 
-        report_text = format_data_for_ai(class_name, students_data)
-        final_report_content.append(report_text)
+        records.extend(build_class_records(class_info, students_data))
 
-    if not final_report_content:
+    if not records:
         return False, "No report content generated"
 
     try:
-        with open(output_filename, "w", encoding="utf-8") as f:
-            f.write("\n\n".join(final_report_content))
+        write_records(output_filename, records)
         return True, output_filename
     except Exception as e:
         return False, str(e)
@@ -0,0 +1,199 @@
+import json
+import time
+import sqlite3
+import logging
+from contextlib import closing
+from app.config.settings import settings
+
+log = logging.getLogger(__name__)
+
+# Lower runs first: a coach waiting on one day beats a whole-week batch
+PRIORITY_DAY = 0
+PRIORITY_WEEK = 10
+
+# Sends that fail this many times (e.g. the document was deleted) are given up on
+EVENT_MAX_ATTEMPTS = 5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    chat_id INTEGER,
+    priority INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'queued',      -- queued | running | done | failed
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    heartbeat REAL,
+    result TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_pick ON jobs (status, priority, id);
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id INTEGER,
+    chat_id INTEGER NOT NULL,
+    kind TEXT NOT NULL,                         -- message | document
+    body TEXT NOT NULL,
+    delivered INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_pending ON events (delivered, id);
+"""
+
+class JobQueue:
+    """Durable job queue shared by the bot (producer) and worker processes (consumers).
+    Progress flows back to chats through the events table."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            # jobs.db files created before events gained retry tracking
+            columns = [row['name'] for row in conn.execute("PRAGMA table_info(events)")]
+            for column in ('attempts', 'failed'):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE events ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0")
+
+    def _connect(self):
+        # Autocommit; multi-statement steps take an explicit write lock (BEGIN IMMEDIATE)
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def enqueue(self, kind, payload, chat_id, priority=PRIORITY_DAY):
+        """Returns (job_id, number of queued/running jobs that will go first)."""
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            cur = conn.execute(
+                "INSERT INTO jobs (kind, payload, chat_id, priority, created, updated) VALUES (?, ?, ?, ?, ?, ?)",
+                (kind, json.dumps(payload), chat_id, priority, now, now))
+            job_id = cur.lastrowid
+            ahead = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE id != ? AND (status = 'running' OR (status = 'queued' AND priority <= ?))",
+                (job_id, priority)).fetchone()[0]
+            conn.execute("COMMIT")
+            return job_id, ahead
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def claim(self, worker_id):
+        """Atomically takes the most urgent queued job, or returns None."""
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' ORDER BY priority, id LIMIT 1").fetchone()
+            if row:
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', worker = ?, heartbeat = ?, attempts = attempts + 1, updated = ? WHERE id = ?",
+                    (worker_id, now, now, row['id']))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        if not row: return None
+        job = dict(row)
+        job['payload'] = json.loads(job['payload'])
+        job['attempts'] += 1
+        return job
+
+    def heartbeat(self, job_ids, worker_id):
+        if not job_ids: return
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.executemany("UPDATE jobs SET heartbeat = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                             [(now, job_id, worker_id) for job_id in job_ids])
+
+    def finish(self, job_id, worker_id, success, result=""):
+        """Records the outcome. Returns False if the job was requeued/reclaimed meanwhile,
+        in which case it belongs to someone else and is left untouched."""
+        with closing(self._connect()) as conn:
+            cur = conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, updated = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                ('done' if success else 'failed', str(result), time.time(), job_id, worker_id))
+            return cur.rowcount > 0
+
+    def prune(self, retention_days):
+        """Deletes finished jobs and delivered/abandoned events older than `retention_days` so jobs.db stays small."""
+        cutoff = time.time() - retention_days * 86400
+        with closing(self._connect()) as conn:
+            events = conn.execute("DELETE FROM events WHERE (delivered = 1 OR failed = 1) AND created < ?", (cutoff,)).rowcount
+            jobs = conn.execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated < ?", (cutoff,)).rowcount
+        if events or jobs:
+            log.info(f"Pruned {jobs} old job(s) and {events} delivered event(s)")
+
+    def recover_stale(self, stale_seconds, max_attempts):
+        """Requeues running jobs whose worker stopped heart-beating (crash/restart).
+        Jobs that keep killing their worker are failed instead of retried forever."""
+        cutoff = time.time() - stale_seconds
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            stale = conn.execute(
+                "SELECT id, chat_id, attempts, payload FROM jobs WHERE status = 'running' AND heartbeat < ?",
+                (cutoff,)).fetchall()
+            for row in stale:
+                day = json.loads(row['payload']).get('day', '?').upper()
+                if row['attempts'] >= max_attempts:
+                    conn.execute("UPDATE jobs SET status = 'failed', result = 'worker crashed', updated = ? WHERE id = ?",
+                                 (time.time(), row['id']))
+                    msg = f"❌ Job #{row['id']} ({day}) failed: the worker crashed {row['attempts']} times."
+                else:
+                    conn.execute("UPDATE jobs SET status = 'queued', worker = NULL, updated = ? WHERE id = ?",
+                                 (time.time(), row['id']))
+                    msg = f"♻️ Job #{row['id']} ({day}) was interrupted, retrying..."
+                log.warning(msg)
+                if row['chat_id'] is not None:
+                    conn.execute("INSERT INTO events (job_id, chat_id, kind, body, created) VALUES (?, ?, 'message', ?, ?)",
+                                 (row['id'], row['chat_id'], msg, time.time()))
+            conn.execute("COMMIT")
+            return len(stale)
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def add_event(self, job_id, chat_id, kind, body):
+        with closing(self._connect()) as conn:
+            conn.execute("INSERT INTO events (job_id, chat_id, kind, body, created) VALUES (?, ?, ?, ?, ?)",
+                         (job_id, chat_id, kind, body, time.time()))
+
+    def pending_events(self, limit=50):
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT * FROM events WHERE delivered = 0 AND failed = 0 ORDER BY id LIMIT ?", (limit,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def mark_delivered(self, event_id):
+        with closing(self._connect()) as conn:
+            conn.execute("UPDATE events SET delivered = 1 WHERE id = ?", (event_id,))
+
+    def record_event_failure(self, event_id, max_attempts=EVENT_MAX_ATTEMPTS):
+        """Counts a failed send; returns True once the event has been given up on."""
+        with closing(self._connect()) as conn:
+            conn.execute("UPDATE events SET attempts = attempts + 1, failed = (attempts + 1 >= ?) WHERE id = ?",
+                         (max_attempts, event_id))
+            row = conn.execute("SELECT failed FROM events WHERE id = ?", (event_id,)).fetchone()
+        return bool(row and row['failed'])
+
+_queue = None
+
+def job_queue():
+    """Process-wide JobQueue on settings.JOB_DB_FILENAME."""
+    global _queue
+    if _queue is None:
+        _queue = JobQueue(settings.JOB_DB_FILENAME)
+    return _queue
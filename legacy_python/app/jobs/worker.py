@@ -0,0 +1,95 @@
+import os
+import time
+import socket
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from app.config.settings import settings
+from app.core.pipeline import run_day
+from app.jobs.queue import job_queue
+
+log = logging.getLogger(__name__)
+
+def available_memory_mb():
+    """MemAvailable from /proc/meminfo (Linux / Pi). None if it can't be read."""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) // 1024
+    except Exception:
+        pass
+    return None
+
+def has_memory_for_job(running_count):
+    free_mb = available_memory_mb()
+    if free_mb is None or free_mb >= settings.WORKER_MIN_FREE_MB:
+        return True
+    # Always let one job through so a busy Pi still makes progress
+    return running_count == 0
+
+def run_job(queue, job):
+    """Executes one job in its own event loop; progress goes to the events table."""
+    job_id, chat_id, payload = job['id'], job['chat_id'], job['payload']
+    log.info(f"Job #{job_id} ({job['kind']}) started: {payload}")
+
+    async def notify(text):
+        queue.add_event(job_id, chat_id, 'message', text)
+
+    async def send_document(path):
+        queue.add_event(job_id, chat_id, 'document', os.path.abspath(path))
+
+    if job['kind'] != 'plan_day':
+        return False, f"Unknown job kind '{job['kind']}'"
+
+    return asyncio.run(run_day(
+        payload['day'], payload['save_folder'], payload['session_id'],
+        notify, send_document, payload.get('records_file')))
+
+def main():
+    queue = job_queue()
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    max_jobs = max(1, settings.WORKER_MAX_JOBS)
+    log.info(f"Worker {worker_id} started (max {max_jobs} job(s), min free {settings.WORKER_MIN_FREE_MB} MB)")
+
+    running = {}    # job_id -> Future
+    started = {}    # job_id -> start time
+    last_prune = 0
+    with ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix="job") as pool:
+        while True:
+            queue.recover_stale(settings.JOB_STALE_SECONDS, settings.JOB_MAX_ATTEMPTS)
+            if time.time() - last_prune > 3600:
+                queue.prune(settings.JOB_RETENTION_DAYS)
+                last_prune = time.time()
+
+            for job_id, future in list(running.items()):
+                if not future.done(): continue
+                del running[job_id]
+                started.pop(job_id, None)
+                try:
+                    success, result = future.result()
+                except Exception as e:
+                    log.error(f"Job #{job_id} crashed: {e}")
+                    success, result = False, str(e)
+                if queue.finish(job_id, worker_id, success, result):
+                    log.info(f"Job #{job_id} finished: {'ok' if success else 'failed'} ({result})")
+                else:
+                    log.warning(f"Job #{job_id} was reassigned while running here; dropping its result")
+
+            hung = [job_id for job_id in running if time.time() - started[job_id] > settings.JOB_TIMEOUT_SECONDS]
+            if hung:
+                # Threads can't be cancelled, so the only way out is to exit: systemd restarts the
+                # worker and recover_stale requeues (or finally fails) the job once its heartbeat lapses
+                log.error(f"Job(s) {', '.join(f'#{j}' for j in hung)} exceeded {settings.JOB_TIMEOUT_SECONDS}s; exiting")
+                os._exit(1)
+
+            queue.heartbeat(list(running), worker_id)
+
+            if len(running) < max_jobs and has_memory_for_job(len(running)):
+                job = queue.claim(worker_id)
+                if job:
+                    running[job['id']] = pool.submit(run_job, queue, job)
+                    started[job['id']] = time.time()
+                    continue
+
+            time.sleep(settings.WORKER_POLL_SECONDS)
@@ -19,9 +19,9 @@ playwright install chromium
 
 # 4. Service
 echo "Setting up systemd service..."
-sudo cp ai_lesson_planner.service /etc/systemd/system/
+sudo cp ai_lesson_planner.service ai_lesson_planner_worker.service /etc/systemd/system/
 sudo systemctl daemon-reload
-sudo systemctl enable ai_lesson_planner
-sudo systemctl start ai_lesson_planner
+sudo systemctl enable ai_lesson_planner ai_lesson_planner_worker
+sudo systemctl start ai_lesson_planner ai_lesson_planner_worker
 
-echo "Installation Complete! Service is running."
+echo "Installation Complete! Bot and worker services are running."